@@ -0,0 +1,7 @@
+from uvicorn_worker import UvicornWorker as BaseUvicornWorker
+
+# gunicorn worker class used in render.yaml ("-k gunicorn_worker.UvicornWorker")
+# the stock worker uses loop="auto"/http="auto" and silently falls back to asyncio/h11 when uvloop/httptools are missing;
+# naming them explicitly makes the worker fail at startup instead, like "uvicorn --loop uvloop --http httptools"
+class UvicornWorker(BaseUvicornWorker):
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
@@ -1,17 +1,24 @@
-import os, time, json, hmac, hashlib, asyncio, tempfile
-from typing import Dict, Optional, Any
-from collections import deque
+import os, time, json, hmac, hashlib, asyncio, tempfile, fcntl
+from contextlib import contextmanager, asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any
 from pathlib import Path
+from urllib.parse import urlencode, quote
 import httpx
-from fastapi import FastAPI, Request, HTTPException, Header
-from fastapi.responses import PlainTextResponse, JSONResponse
+import orjson
+from fastapi import FastAPI, Request, HTTPException, Header, Depends
+from fastapi.responses import PlainTextResponse, ORJSONResponse, Response
 from pydantic import BaseModel
 
-app = FastAPI()
+# ORJSONResponse serializes with orjson (Rust-native) instead of stdlib json, so JSON endpoints cost less CPU
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # --- Config ---
 ADMIN_TOKEN       = os.getenv("ADMIN_TOKEN")
 BOT_SHARED_SECRET = os.getenv("BOT_SHARED_SECRET")
+# secrets as bytes, encoded once, for constant-time comparison with "hmac.compare_digest"
+ADMIN_TOKEN_BYTES       = (ADMIN_TOKEN or "").encode()
+BOT_SHARED_SECRET_BYTES = (BOT_SHARED_SECRET or "").encode()
 
 HH_CLIENT_ID      = os.getenv("HH_CLIENT_ID")
 HH_CLIENT_SECRET  = os.getenv("HH_CLIENT_SECRET")
@@ -24,43 +31,145 @@ USER_AGENT        = os.getenv("USER_AGENT")
 PERSIST_DIR   = Path(os.getenv("PERSIST_DIR", "/var/data"))
 TOKENS_PATH   = PERSIST_DIR / "tokens.json"
 PENDING_PATH  = PERSIST_DIR / "pending.json"
+# lock file held while a worker process reads, merges and rewrites the files above
+LOCK_PATH     = PERSIST_DIR / ".lock"
+# how often (seconds) each worker re-reads the files to pick up changes written by other workers; 0 disables it
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", "5"))
 
 
-# --- Simple in-memory stores ---
-BUFFER_MAX = 200
-#for storing in memory we use specialized data structure optimized "deque" for fast appends and pops from both ends
-#this is C-implemented class with internal pointers and optional maxlen.
-pending = deque(maxlen=BUFFER_MAX)          # raw callback hits (for audit)
-# tokens is nested dictionary keyed by state
-# key: state, value: {access_token, refresh_token, token_type, scope, expires_at:int}
-tokens: Dict[str, Dict] = {}
-
 # --- Models ---
 #Required for parsing the request body (JSON)
 class StatePayload(BaseModel):
     state: str
 
+# One record of "tokens". "slots=True" stores the fields in fixed slots instead of a per-object dict:
+# less memory per user and faster attribute access than dict key lookups. orjson serializes dataclasses natively.
+@dataclass(slots=True)
+class TokenEntry:
+    access_token: str
+    refresh_token: Optional[str]
+    token_type: str
+    expires_in: Optional[int]
+    expires_at: int
+
+
+# --- Simple in-memory stores ---
+BUFFER_MAX = 200
+#raw callback hits (for audit) are stored in a fixed-size ring buffer: a list preallocated with BUFFER_MAX slots
+#and an index of the slot to write next. When the buffer is full, the new item overwrites the oldest one (FIFO).
+pending_buf: List[Optional[Dict]] = [None] * BUFFER_MAX
+pending_idx = 0
+# monotonic counter bumped on every change of "pending", used to know when the cached response is outdated
+_pending_version = 0
+# serialized /admin/pending response, its ETag and the "_pending_version" it was built for
+_pending_cache_bytes: Optional[bytes] = None
+_pending_cache_etag: Optional[str] = None
+_pending_cache_version = -1
+# tokens is dictionary keyed by state
+# key: state, value: TokenEntry(access_token, refresh_token, token_type, expires_in, expires_at:int)
+tokens: Dict[str, TokenEntry] = {}
+# monotonic counter bumped on every change of "tokens", used to know when cached views are outdated
+_tokens_version = 0
+# serialized /admin/tokens response (tokens hidden), its ETag and the "_tokens_version" it was built for
+_tokens_redacted_cache: Optional[bytes] = None
+_tokens_redacted_etag: Optional[str] = None
+_tokens_redacted_version = -1
+
+# --- Write-behind persistence ---
+# pending (audit) items are not written to disk on every request: handlers only mark the store as "dirty"
+# and a background task writes it at most once per FLUSH_INTERVAL seconds, so a burst of callbacks costs a single fsync
+# token changes are written right away (see "_set_token_now"/"_refresh_state") because other workers must see them;
+# the tokens flusher only retries writes that failed
+FLUSH_INTERVAL = 1.0
+_tokens_dirty = asyncio.Event()
+_pending_dirty = asyncio.Event()
+_background_tasks: list = []
+# with several worker processes each one has its own in-memory stores, the files on disk are shared between them.
+# a worker writes only what it changed, merged into the current file content, so it never overwrites changes of others.
+# changes of "tokens" made by this worker and not yet on disk, key: state, value: record or None if deleted
+_tokens_changes: Dict[str, Optional[TokenEntry]] = {}
+# pending items added by this worker and not yet on disk
+_pending_new: List[Dict] = []
+# identity of each file (see "_file_id") when this worker last read or wrote it, to skip re-reading unchanged files
+_disk_ids: Dict[Path, Optional[tuple]] = {}
+# saves and syncs of this worker run one at a time, so an older file read never replaces a newer merged result
+_disk_sync_lock = asyncio.Lock()
+
+# --- Shared HTTP client ---
+# one long-lived client for all calls to HH API, created at startup and closed at shutdown
+# keeps TCP+TLS connections to hh.ru alive in a pool, so token exchanges reuse a warm socket instead of a new handshake
+http_client: Optional[httpx.AsyncClient] = None
+# max number of requests to HH token endpoint in flight at once (per worker), a burst of callbacks waits here
+# instead of opening more connections, and the waiting requests reuse the already warm ones
+HH_TOKEN_CONCURRENCY = int(os.getenv("HH_TOKEN_CONCURRENCY", "10"))
+token_sem = asyncio.Semaphore(HH_TOKEN_CONCURRENCY)
+
 # --- Persistence helpers ---
 def _ensure_persist_dir():
     # "exists_ok=True" means that if the directory already exists, it will not do anything and not raise an error
     PERSIST_DIR.mkdir(parents=True, exist_ok=True)
 
+def _lock_acquire():
+    """Opens the lock file and takes the exclusive lock on it, blocks until other holders release it."""
+    _ensure_persist_dir()
+    lock_file = open(LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    except BaseException:
+        lock_file.close()
+        raise
+    return lock_file
+
+def _lock_release(lock_file) -> None:
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
+
+@contextmanager
+def _file_lock():
+    """Exclusive lock shared by all worker processes, held around read-merge-write of the persistence files."""
+    lock_file = _lock_acquire()
+    try:
+        yield
+    finally:
+        _lock_release(lock_file)
+
+@asynccontextmanager
+async def _file_lock_async():
+    """The same lock for coroutines that await while holding it; waiting for the lock runs in a worker thread."""
+    acquiring = asyncio.ensure_future(asyncio.to_thread(_lock_acquire))
+    try:
+        # "shield" keeps the waiting thread's result reachable if this coroutine is cancelled
+        lock_file = await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # the thread still gets the lock eventually, release it right away then
+        acquiring.add_done_callback(lambda f: f.cancelled() or f.exception() or _lock_release(f.result()))
+        raise
+    try:
+        yield
+    finally:
+        _lock_release(lock_file)
+
+def _file_id(path: Path) -> Optional[tuple]:
+    """Identifies the current version of a file, None if missing."""
+    # mtime alone can stay the same for two writes within one filesystem clock tick,
+    # but every "os.replace" puts a new inode in place, so the inode number tells writes apart
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
 def _atomic_write_json(path: Path, data) -> None:
     """Write JSON atomically to avoid partial writes or corrupted JSON files on crashes or restarts."""
     _ensure_persist_dir()
-    #argument "data" can be either a deque or a plain dictionary
-    #if it is a deque, we convert it to a plain list before dumping to JSON, otherwise get error "TypeError: can't serialize deque"
-    # for that, we use built-in function "isinstance" to checks whether an object belongs to deque or not
-    if isinstance(data, deque):
-        serializable = list(data)
-    else:
-        serializable = data
     # create a temporary file in the same directory as the target file, with the same name but with .tmp suffix
     tmp_fd, tmp_path = tempfile.mkstemp(dir=str(PERSIST_DIR), prefix=path.name, suffix=".tmp")
     try:
-        with os.fdopen(tmp_fd, "w") as f:
-            # dump the serializable data to the temporary file
-            json.dump(serializable, f, ensure_ascii=False, indent=2)
+        with os.fdopen(tmp_fd, "wb") as f:
+            # serialize with orjson straight to compact UTF-8 bytes (no indentation) and write them in a single call
+            f.write(orjson.dumps(data))
             # flush the file to ensure data is written to disk
             # hand it off to the operating system everything you’ve written into the file object’s internal buffer
             f.flush()
@@ -91,57 +200,271 @@ def _load_json_or_default(path: Path, default: Any) -> Any:
         # Corrupt file: keep default but do not overwrite automatically
         return default
 
-def save_tokens():
-    _atomic_write_json(TOKENS_PATH, tokens)
+def _sanitize_tokens(loaded_tokens: Any) -> Dict[str, TokenEntry]:
+    """Returns tokens loaded from disk as TokenEntry records, with invalid records dropped and "expires_at" as int."""
+    # check if the loaded data is a dictionary using built-in function "isinstance"
+    if not isinstance(loaded_tokens, dict):
+        return {}
+    # sanitize numeric fields just in case
+    # When read JSON from disk, the data might technically load fine, but may be inconsistent to use directly in memory.
+    # The iteration ensures that what you load is actually valid, type-consistent, and won’t crash your logic later.
+    for key, value in list(loaded_tokens.items()):
+        if not isinstance(value, dict) or not value.get("access_token"):
+            # remove the key-value pair from the dictionary if the value is not a dictionary with an access token
+            loaded_tokens.pop(key, None)
+            continue
+        # every record gets an int "expires_at", so readers can use it without checks or conversion
+        # a missing value is treated as already expired (refresh on first use)
+        try:
+            expires_at = int(value.get("expires_at", 0))
+        except Exception:
+            expires_at = int(time.time()) + 300
+        loaded_tokens[key] = TokenEntry(
+            access_token=value["access_token"],
+            refresh_token=value.get("refresh_token"),
+            token_type=value.get("token_type") or "Bearer",
+            expires_in=value.get("expires_in"),
+            expires_at=expires_at,
+        )
+    return loaded_tokens
+
+def _sanitize_pending(loaded_pending: Any) -> List[Dict]:
+    """Returns the newest BUFFER_MAX pending items loaded from disk."""
+    if not isinstance(loaded_pending, list):
+        return []
+    return loaded_pending[-BUFFER_MAX:]
+
+# readers don't take the lock: "os.replace" swaps files atomically, so a reader always sees a complete file
+# the file identity is read before the content, so a file replaced in between is simply read again next time
+def _read_tokens_file():
+    file_id = _file_id(TOKENS_PATH)
+    return _sanitize_tokens(_load_json_or_default(path=TOKENS_PATH, default={})), file_id
+
+def _read_pending_file():
+    file_id = _file_id(PENDING_PATH)
+    return _sanitize_pending(_load_json_or_default(path=PENDING_PATH, default=[])), file_id
+
+def _read_changed_files(known_ids: Dict[Path, Optional[tuple]]):
+    """Reads only the files whose identity differs from "known_ids". Returns (tokens, pending), None for an unchanged file."""
+    tokens_read = _read_tokens_file() if _file_id(TOKENS_PATH) != known_ids.get(TOKENS_PATH, ()) else None
+    pending_read = _read_pending_file() if _file_id(PENDING_PATH) != known_ids.get(PENDING_PATH, ()) else None
+    return tokens_read, pending_read
+
+def _merge_write_tokens_locked(changes: Dict[str, Optional[TokenEntry]]):
+    """Applies this worker's changes on top of the tokens file and writes it back, the caller holds the lock. Returns the merged tokens."""
+    merged = _sanitize_tokens(_load_json_or_default(path=TOKENS_PATH, default={}))
+    for state, record in changes.items():
+        if record is None:
+            merged.pop(state, None)
+        else:
+            merged[state] = record
+    _atomic_write_json(TOKENS_PATH, merged)
+    return merged, _file_id(TOKENS_PATH)
+
+def _merge_write_tokens(changes: Dict[str, Optional[TokenEntry]]):
+    """Same as "_merge_write_tokens_locked", taking the lock."""
+    with _file_lock():
+        return _merge_write_tokens_locked(changes)
+
+def _merge_write_pending(new_items: List[Dict]):
+    """Appends this worker's new items to the pending file and writes it back, under the lock. Returns the merged items."""
+    with _file_lock():
+        merged = _sanitize_pending(_load_json_or_default(path=PENDING_PATH, default=[]) + new_items)
+        _atomic_write_json(PENDING_PATH, merged)
+        return merged, _file_id(PENDING_PATH)
+
+def _apply_tokens_from_disk(disk_tokens: Dict[str, TokenEntry], file_id: Optional[tuple]):
+    """Replaces in-memory "tokens" with the disk content plus this worker's changes that are not on disk yet."""
+    global _tokens_version
+    _disk_ids[TOKENS_PATH] = file_id
+    for state, record in _tokens_changes.items():
+        if record is None:
+            disk_tokens.pop(state, None)
+        else:
+            disk_tokens[state] = record
+    # bump the version only on a real change, so cached responses and ETags stay valid otherwise
+    if disk_tokens != tokens:
+        tokens.clear()
+        tokens.update(disk_tokens)
+        _tokens_version += 1
+
+def _apply_pending_from_disk(disk_pending: List[Dict], file_id: Optional[tuple]):
+    """Refills the "pending" ring buffer with the disk content plus this worker's items that are not on disk yet."""
+    global _pending_version, pending_idx
+    _disk_ids[PENDING_PATH] = file_id
+    items = (disk_pending + _pending_new)[-BUFFER_MAX:]
+    if items != pending_items():
+        #Removes all existing items from the global "pending" ring buffer
+        pending_buf[:] = [None] * BUFFER_MAX
+        pending_idx = 0
+        #Fill the ring buffer with the loaded data
+        for item in items:
+            pending_append(item)
+        _pending_version += 1
+
+# saving runs the blocking lock+merge+write+fsync in a worker thread via "asyncio.to_thread", so the event loop keeps serving requests
+# the collected changes are taken first, on the event loop, so new changes made while the thread runs go to a fresh collection
+async def _write_tokens_changes(merge_write) -> None:
+    """Writes the collected token changes with "merge_write" and loads the merged result, the caller holds "_disk_sync_lock"."""
+    global _tokens_changes
+    changes, _tokens_changes = _tokens_changes, {}
+    try:
+        merged, file_id = await asyncio.to_thread(merge_write, changes)
+    except Exception:
+        # put the changes back (changes made meanwhile are newer and win) so the next save writes them
+        changes.update(_tokens_changes)
+        _tokens_changes = changes
+        raise
+    # the merged file also contains changes of other workers, take them into memory
+    _apply_tokens_from_disk(merged, file_id)
+
+async def save_tokens():
+    async with _disk_sync_lock:
+        await _write_tokens_changes(_merge_write_tokens)
+
+async def save_pending():
+    global _pending_new
+    async with _disk_sync_lock:
+        new_items, _pending_new = _pending_new, []
+        try:
+            merged, file_id = await asyncio.to_thread(_merge_write_pending, new_items)
+        except Exception:
+            _pending_new = new_items + _pending_new
+            raise
+        _apply_pending_from_disk(merged, file_id)
+
+async def sync_from_disk():
+    """Picks up changes written to disk by other workers, reading only files replaced since last read or write."""
+    async with _disk_sync_lock:
+        # "stat" calls and reads run in a worker thread, like the rest of the file I/O
+        tokens_read, pending_read = await asyncio.to_thread(_read_changed_files, dict(_disk_ids))
+        if tokens_read is not None:
+            _apply_tokens_from_disk(*tokens_read)
+        if pending_read is not None:
+            _apply_pending_from_disk(*pending_read)
+
+def _mark_tokens_changed(state: str):
+    """Call after any change of tokens[state]: invalidates cached views and schedules a save to disk."""
+    global _tokens_version
+    _tokens_version += 1
+    # remember the current record (None if deleted) to be merged into the file on the next save
+    _tokens_changes[state] = tokens.get(state)
+    _tokens_dirty.set()
+
+def pending_items() -> List[Dict]:
+    """Returns pending items as a new list, from the oldest to the newest, without empty slots."""
+    # slots from "pending_idx" to the end hold the older items, slots before it hold the newer ones
+    return [x for x in pending_buf[pending_idx:] if x is not None] + [x for x in pending_buf[:pending_idx] if x is not None]
+
+def pending_append(item: Dict):
+    """Writes the item into the next slot of the ring buffer, overwriting the oldest item when the buffer is full."""
+    global pending_idx
+    pending_buf[pending_idx] = item
+    pending_idx = (pending_idx + 1) % BUFFER_MAX
+
+def _mark_pending_changed(item: Dict):
+    """Call after appending an item to "pending": invalidates the cached response and schedules a save to disk."""
+    global _pending_version
+    _pending_version += 1
+    _pending_new.append(item)
+    _pending_dirty.set()
+
+async def _flusher(dirty: asyncio.Event, save) -> None:
+    """Background loop: waits until the store is marked dirty, lets more changes pile up, then writes it once."""
+    while True:
+        await dirty.wait()
+        # collect all changes arriving within the interval into the same write
+        await asyncio.sleep(FLUSH_INTERVAL)
+        dirty.clear()
+        try:
+            await save()
+        except Exception:
+            # keep the data in memory and retry on the next round
+            dirty.set()
 
-def save_pending():
-    # pending is deque, so we convert it to a plain list before dumping to JSON otherwise get error "TypeError: can't serialize deque"
-    _atomic_write_json(PENDING_PATH, pending)
+async def _syncer() -> None:
+    """Background loop: every SYNC_INTERVAL seconds picks up changes written to disk by other workers."""
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL)
+        try:
+            await sync_from_disk()
+        except Exception:
+            # keep serving from memory and try again on the next round
+            pass
 
 def load_all():
-    # tokens
-    loaded_tokens = _load_json_or_default(path=TOKENS_PATH, default={})
-    # check if the loaded data is a dictionary using built-in function "isinstance"
-    if isinstance(loaded_tokens, dict):
-        # sanitize numeric fields just in case
-        # When read JSON from disk, the data might technically load fine, but may be inconsistent to use directly in memory.
-        # The iteration ensures that what you load is actually valid, type-consistent, and won’t crash your logic later.
-        for key, value in list(loaded_tokens.items()):
-            if not isinstance(value, dict):
-                # remove the key-value pair from the dictionary if the value is not a dictionary
-                loaded_tokens.pop(key, None)
-                continue
-            if "expires_at" in value:
-                try:
-                    value["expires_at"] = int(value["expires_at"])
-                except Exception:
-                    value["expires_at"] = int(time.time()) + 300    
-    else:
-        loaded_tokens = {}
-    #Removes all existing key–value pairs from the global "tokens" dictionary
-    tokens.clear()
-    #Update the global "tokens" dictionary with the loaded data
-    tokens.update(loaded_tokens)
-
-    # pending
-    loaded_pending = _load_json_or_default(path=PENDING_PATH, default=[])
-    dq = deque(maxlen=BUFFER_MAX)
-    if isinstance(loaded_pending, list):
-        dq.extend(loaded_pending[:BUFFER_MAX])
-    #Removes all existing key–value pairs from the global "pending" deque
-    pending.clear()
-    #Update the global "pending" deque with the loaded data
-    pending.extend(dq)
+    _apply_tokens_from_disk(*_read_tokens_file())
+    _apply_pending_from_disk(*_read_pending_file())
 
 # --- Startup hook ---
 @app.on_event("startup")
 #“Running when the application starts, before handling any incoming HTTP request
-def _startup_load_from_disk():
-    _ensure_persist_dir()
-    load_all()
+async def _startup_load_from_disk():
+    # file reads run in a worker thread, like the writes, to keep blocking disk I/O off the event loop
+    await asyncio.to_thread(_ensure_persist_dir)
+    await asyncio.to_thread(load_all)
+
+@app.on_event("startup")
+async def _startup_http_client():
+    global http_client
+    http_client = httpx.AsyncClient(
+        # HTTP/2 lets concurrent requests share one connection to hh.ru (falls back to HTTP/1.1 if not offered)
+        http2=True,
+        timeout=httpx.Timeout(15.0, connect=5.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0),
+        # USER_AGENT may be unset (local runs), then httpx's default User-Agent is used
+        headers={"User-Agent": USER_AGENT} if USER_AGENT else None,
+    )
+
+@app.on_event("startup")
+async def _startup_background_tasks():
+    _background_tasks.append(asyncio.create_task(_flusher(_tokens_dirty, save_tokens)))
+    _background_tasks.append(asyncio.create_task(_flusher(_pending_dirty, save_pending)))
+    if SYNC_INTERVAL > 0:
+        _background_tasks.append(asyncio.create_task(_syncer()))
+
+# --- Shutdown hook ---
+@app.on_event("shutdown")
+# Stop background tasks and write out whatever is still not on disk
+async def _shutdown_flushers():
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    if _tokens_dirty.is_set():
+        _tokens_dirty.clear()
+        await save_tokens()
+    if _pending_dirty.is_set():
+        _pending_dirty.clear()
+        await save_pending()
+
+@app.on_event("shutdown")
+# Running when the application stops, closes pooled connections to HH API
+async def _shutdown_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
 
 
 # --- Helpers ---
+# request bodies for HH token endpoint are form-urlencoded; the constant part (grant type and app credentials)
+# is encoded once here, each request only appends its own encoded code/refresh_token
+# unset values are sent empty, like httpx does for None in "data="
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+_AUTHCODE_POST_PREFIX = urlencode({
+    "grant_type": "authorization_code",
+    "redirect_uri": HH_REDIRECT_URI or "",
+    "client_id": HH_CLIENT_ID or "",
+    "client_secret": HH_CLIENT_SECRET or "",
+})
+_REFRESH_POST_PREFIX = urlencode({
+    "grant_type": "refresh_token",
+    "client_id": HH_CLIENT_ID or "",
+    "client_secret": HH_CLIENT_SECRET or "",
+    "redirect_uri": HH_REDIRECT_URI or "",
+})
+
 async def exchange_code_for_tokens(code: str) -> Dict:
     """
     Exchange HH OAuth code for tokens from HH API.
@@ -149,21 +472,12 @@ async def exchange_code_for_tokens(code: str) -> Dict:
     Calculates the timestamp for the expiration of the access_token 
     Returns a dictionary with access_token, token_type, expires_in, refresh_token, expires_at - computed absolute timestamp.
     """
-    headers={
-        "Content-Type": "application/x-www-form-urlencoded",
-        "User-Agent": USER_AGENT
-        }
-    data = {
-        "grant_type": "authorization_code",
-        "code": code,
-        "redirect_uri": HH_REDIRECT_URI,
-        "client_id": HH_CLIENT_ID,
-        "client_secret": HH_CLIENT_SECRET,
-    }
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.post(HH_TOKEN_URL, data=data, headers=headers) 
-        r.raise_for_status()
-        j = r.json()
+    body = f"{_AUTHCODE_POST_PREFIX}&code={quote(code, safe='')}".encode()
+    # User-Agent is already set on the shared client
+    async with token_sem:
+        r = await http_client.post(HH_TOKEN_URL, content=body, headers=FORM_HEADERS)
+    r.raise_for_status()
+    j = r.json()
     # HH typically returns: access_token, token_type, expires_in, refresh_token
     now = int(time.time())
     # we add to dict "expires_at" the current time plus the number of seconds in the "expires_in" field
@@ -171,85 +485,137 @@ async def exchange_code_for_tokens(code: str) -> Dict:
     # return the dictionary with tokens and the computed expires_at absolute timestamp
     return j
 
-async def refresh_with_refresh_token(refresh_token: str) -> Dict:
+async def refresh_with_refresh_token(refresh_token: str, now: Optional[int] = None) -> Dict:
     """
     Refresh HH tokens using a refresh_token from HH API.
     Gets {access_token, token_type, expires_in, refresh_token}
-    Calculates the timestamp for the expiration of the access_token 
+    Calculates the timestamp for the expiration of the access_token from "now" (current time if not given by the caller)
     Returns a dictionary with {access_token, token_type, expires_in, refresh_token, expires_at - computed absolute timestamp}.
     """
-    headers={
-        "Content-Type": "application/x-www-form-urlencoded",
-        "User-Agent": USER_AGENT
-        }
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "client_id": HH_CLIENT_ID,
-        "client_secret": HH_CLIENT_SECRET,
-        "redirect_uri": HH_REDIRECT_URI,
-    }
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.post(HH_TOKEN_URL, data=data, headers=headers)
-        r.raise_for_status()
-        j = r.json()
-    now = int(time.time())
+    body = f"{_REFRESH_POST_PREFIX}&refresh_token={quote(refresh_token, safe='')}".encode()
+    async with token_sem:
+        r = await http_client.post(HH_TOKEN_URL, content=body, headers=FORM_HEADERS)
+    r.raise_for_status()
+    j = r.json()
+    if now is None:
+        now = int(time.time())
     j["expires_at"] = now + int(j.get("expires_in", 3600))
     return j
 
-async def get_valid_access_token_for_state(state: str) -> Optional[Dict]:
+async def get_valid_access_token_for_state(state: str) -> Optional[TokenEntry]:
     """
-    Returns dict with {access_token, token_type, expires_in, refresh_token, expires_at - computed absolute timestamp}, 
+    Returns TokenEntry with access_token, token_type, expires_in, refresh_token, expires_at - computed absolute timestamp, 
     Refreshing tokens if expiration is within 60 seconds.
     """
     # get the value from the tokens dictionary by key "state"
     item = tokens.get(state)
     if not item:
-        return None
+        # the callback may have been handled by another worker process: check the file before giving up
+        await sync_from_disk()
+        item = tokens.get(state)
+        if not item:
+            return None
 
     now = int(time.time())
-    # get the expiration timestamp from the item, if not found, use 0
-    expires_at = int(item.get("expires_at", 0))
+    # get the expiration timestamp from the item, always stored as int (by writers and by "load_all")
+    expires_at = item.expires_at
 
     # Refresh if expiring within 60s
     if now >= expires_at - 60:
-        refresh_token = item.get("refresh_token")
-        if not refresh_token:
+        if not item.refresh_token:
             # Can't refresh; return as-is (caller may re-auth if 401 later)
             return item
-
-        # refresh the tokens using the refresh_token from the item
-        refreshed = await refresh_with_refresh_token(refresh_token)
-        tokens[state] = {
-            "access_token": refreshed["access_token"],
-            "refresh_token": refreshed.get("refresh_token", refresh_token),  # HH may rotate or not
-            "token_type": refreshed.get("token_type", "Bearer"),
-            "expires_in": refreshed.get("expires_in"),
-            "expires_at": refreshed["expires_at"],
-        }
-        # save the updated tokens to disk
-        save_tokens()
-        # update the item in memory with the refreshed tokens
-        item = tokens[state]
+        # reuse "now" read above instead of reading the clock again
+        item = await _refresh_state(state, now)
     return item
 
-def require_admin(admin_token: str):
-    if admin_token != ADMIN_TOKEN:
+async def _refresh_state(state: str, now: int) -> Optional[TokenEntry]:
+    """
+    Refreshes the tokens of "state" via HH API, safe with several worker processes.
+    HH rotates the refresh_token, so the old one must be used only once: the refresh runs under the file lock,
+    re-reads the tokens file first (another worker may have refreshed or deleted the state already),
+    and writes the new record to disk before releasing the lock.
+    Returns the current record for the state, None if it was deleted.
+    """
+    # "_disk_sync_lock" stops this worker's flusher/sync from loading the file while the refresh holds the file lock
+    # both locks stay held during the HTTP call; refreshes are rare (once per token lifetime) so the wait is acceptable
+    async with _disk_sync_lock:
+        async with _file_lock_async():
+            # take the current file content into memory (plus this worker's unsaved changes)
+            _apply_tokens_from_disk(*await asyncio.to_thread(_read_tokens_file))
+            item = tokens.get(state)
+            if item is None or now < item.expires_at - 60 or not item.refresh_token:
+                # deleted, already refreshed by another worker, or can't be refreshed
+                return item
+
+            # refresh the tokens using the refresh_token from the item
+            refreshed = await refresh_with_refresh_token(item.refresh_token, now=now)
+            tokens[state] = TokenEntry(
+                access_token=refreshed["access_token"],
+                refresh_token=refreshed.get("refresh_token", item.refresh_token),  # HH may rotate or not
+                token_type=refreshed.get("token_type", "Bearer"),
+                expires_in=refreshed.get("expires_in"),
+                expires_at=refreshed["expires_at"],
+            )
+            # mark tokens as changed and write them now, under the same lock, instead of waiting for the flusher
+            _mark_tokens_changed(state)
+            await _write_tokens_changes(_merge_write_tokens_locked)
+            return tokens.get(state)
+
+async def _set_token_now(state: str, entry: Optional[TokenEntry]) -> bool:
+    """
+    Sets tokens[state] to "entry" (deletes it if None) and writes it to disk right away, so other workers see it on their next read.
+    Runs under the same locks as "_refresh_state", so it never interleaves with a refresh of this worker or of another one.
+    Returns whether the state existed before, in this worker's memory or on disk.
+    """
+    async with _disk_sync_lock:
+        async with _file_lock_async():
+            # take the current file content into memory first: the state may exist only on disk, written by another worker
+            _apply_tokens_from_disk(*await asyncio.to_thread(_read_tokens_file))
+            existed = state in tokens
+            if entry is None:
+                if not existed:
+                    return False
+                tokens.pop(state)
+            else:
+                tokens[state] = entry
+            _mark_tokens_changed(state)
+            await _write_tokens_changes(_merge_write_tokens_locked)
+            return existed
+
+# --- Auth dependencies ---
+# attached to endpoints with "dependencies=[Depends(...)]", FastAPI runs them before the endpoint body
+# "hmac.compare_digest" takes the same time wherever the strings differ, so the secret can't be guessed by timing responses
+# an unset secret never matches, otherwise a request without the header would pass
+BEARER_PREFIX = "Bearer "
+
+# admin_token: Optional[str] = Header(None) -> FastAPI automatically maps the HTTP header "admin-token" to this parameter
+async def admin_dep(admin_token: Optional[str] = Header(None)) -> None:
+    if not (ADMIN_TOKEN_BYTES and admin_token and hmac.compare_digest(admin_token.encode(), ADMIN_TOKEN_BYTES)):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-def require_bot(auth_header: Optional[str]):
-    if not auth_header or not auth_header.startswith("Bearer "):
+# authorization: Optional[str] = Header(None) -> FastAPI automatically maps the HTTP header "Authorization" to this parameter
+async def bot_dep(authorization: Optional[str] = Header(None)) -> None:
+    if not authorization or authorization[:7] != BEARER_PREFIX:
         raise HTTPException(status_code=401, detail="Missing bearer token")
-    if auth_header.split(" ", 1)[1].strip() != BOT_SHARED_SECRET:
+    # the secret follows the 7-character prefix, sliced without split/strip
+    if not (BOT_SHARED_SECRET_BYTES and hmac.compare_digest(authorization[7:].encode(), BOT_SHARED_SECRET_BYTES)):
         raise HTTPException(status_code=401, detail="Invalid bearer token")
 
 
+def _etag(body: bytes) -> str:
+    """ETag built from the response bytes, lets admin pollers get "304 Not Modified" while nothing changed."""
+    # computed from the content, not from the version counters: those are per process and restart from 0,
+    # so the same tag is valid on every worker and after restarts
+    return f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+
 # --- Endpoints ---
 
 
 @app.get("/")
 # Health check endpoint to verify the service is running
-def health():
+async def health():
     return PlainTextResponse("Endpoint is available")
 
 
@@ -261,32 +627,29 @@ async def hh_callback(request: Request):
     state = request.query_params.get("state")
     if not code or not state:
         raise HTTPException(status_code=400, detail="Missing code/state")
+    # read "request.client" once, it is built on access
+    client = request.client
     # audit trail
-    item = {
-        "state": state,
-        "code": code,
-        "ts": int(time.time()),
-        "ip": request.client.host if request.client else None,
-    }
-    # add the item to the pending deque in memory buffer
-    pending.append(item)
-    # save the pending data to disk
-    save_pending()
+    item = {"state": state, "code": code, "ts": int(time.time()), "ip": client.host if client is not None else None}
+    # add the item to the pending ring buffer in memory
+    pending_append(item)
+    # mark pending as changed, background flusher saves it to disk
+    _mark_pending_changed(item)
 
     # Immediately exchange the code -> tokens and store in memory under variable called "tokens"
     try:
         # HH typically returns: access_token, token_type, expires_in, refresh_token
         # await is used to wait for the coroutine to complete
         token = await exchange_code_for_tokens(code)
-        tokens[state] = {
-            "access_token": token["access_token"],
-            "refresh_token": token.get("refresh_token"),
-            "token_type": token.get("token_type", "Bearer"),
-            "expires_in": token.get("expires_in"),
-            "expires_at": token["expires_at"],
-        }
-        # save the updated tokens to disk
-        save_tokens()
+        # store in memory and write to disk right away (not via the background flusher),
+        # so the bot polling /token/by-state finds the state immediately, whichever worker answers it
+        await _set_token_now(state, TokenEntry(
+            access_token=token["access_token"],
+            refresh_token=token.get("refresh_token"),
+            token_type=token.get("token_type", "Bearer"),
+            expires_in=token.get("expires_in"),
+            expires_at=token["expires_at"],
+        ))
         return PlainTextResponse("Вы успешно авторизовались в HH.ru, можете вернуться в Telegram")
     except httpx.HTTPError as e:
         # keep the pending record, but don’t store tokens
@@ -294,54 +657,71 @@ async def hh_callback(request: Request):
 
 
 
-@app.post("/token/by-state")
+@app.post("/token/by-state", response_class=ORJSONResponse, dependencies=[Depends(bot_dep)])
 # Bot → Render: return a valid access token for a given state (refreshing if needed)
+# Bearer and BOT_SHARED_SECRET in the authorization header are checked by "bot_dep"
 # payload: StatePayload -> comes from the request body (JSON)
-# authorization: Optional[str] = Header(None) -> FastAPI automatically maps that HTTP header to the Python parameter "authorization".
-async def token_by_state(payload: StatePayload, authorization: Optional[str] = Header(None)):
-    #check Bearer and BOT_SHARED_SECRET in the authorization header
-    require_bot(authorization)
+async def token_by_state(payload: StatePayload):
     # get the valid access token for the given "state" from the tokens dictionary
     item = await get_valid_access_token_for_state(payload.state)
     # if not found, return 404 error
     if not item:
         raise HTTPException(status_code=404, detail="State not ready or not found")
     return {
-        "access_token": item["access_token"],
-        "token_type": item.get("token_type", "Bearer"),
-        "expires_in": item.get("expires_in"),
-        "expires_at": item["expires_at"],
+        "access_token": item.access_token,
+        "token_type": item.token_type,
+        "expires_in": item.expires_in,
+        "expires_at": item.expires_at,
     }
 
 
 
-@app.delete("/admin/state")
+@app.delete("/admin/state", dependencies=[Depends(admin_dep)])
 # Optional: one-shot dequeue/cleanup after you’ve stored the mapping user ↔ tokens elsewhere
+# ADMIN_TOKEN in the "admin-token" header is checked by "admin_dep"
 # payload: StatePayload -> comes from the request body (JSON)
-# authorization: Optional[str] = Header(None) -> FastAPI automatically maps that HTTP header to the Python parameter "admin_token".
-def admin_delete_state(payload: StatePayload, admin_token: Optional[str] = Header(None)):
-    #check ADMIN_TOKEN in the authorization header
-    require_admin(admin_token)
-    #using .pop() method remove the item with key "state" and returns its value. 
-    #if key is not found, returns default (None)
-    existed = tokens.pop(payload.state, None)
-    # save the updated tokens to disk
-    save_tokens()
-    #If a token was found and removed → "existed" is a dictionary → bool(existed) = True
-    #If no token is not removed → "existed" = None → bool(existed) = False
-    return {"deleted": bool(existed)} 
-
-
-@app.get("/admin/pending")
-def admin_pending(admin_token: Optional[str] = Header(None)):
-    #check ADMIN_TOKEN in the authorization header
-    require_admin(admin_token)
-    return JSONResponse(list(pending))
-
-
-@app.get("/admin/tokens")
-def admin_tokens(admin_token: Optional[str] = Header(None)):
-    #check ADMIN_TOKEN in the authorization header
-    require_admin(admin_token)
-    #builds and returns a JSON response showing all tokens in memory, but with their sensitive parts (access and refresh tokens) hidden by replacing them with "***".
-    return JSONResponse({k: {**v, "access_token": "***", "refresh_token": "***"} for k, v in tokens.items()})
+async def admin_delete_state(payload: StatePayload):
+    #remove the state from memory and from disk right away (also if only another worker has it so far)
+    #waits for a refresh of the state in progress, so the refresh can't bring it back afterwards
+    existed = await _set_token_now(payload.state, None)
+    #If a token was found and removed → existed = True
+    #If no token was found → existed = False
+    return {"deleted": existed}
+
+
+@app.get("/admin/pending", response_class=ORJSONResponse, dependencies=[Depends(admin_dep)])
+async def admin_pending(request: Request):
+    global _pending_cache_bytes, _pending_cache_etag, _pending_cache_version
+    #pending changes only on callbacks, so the serialized bytes and their ETag are reused between them
+    if _pending_cache_version != _pending_version:
+        _pending_cache_bytes = orjson.dumps(pending_items())
+        _pending_cache_etag = _etag(_pending_cache_bytes)
+        _pending_cache_version = _pending_version
+    #client already has this content → answer with headers only
+    if request.headers.get("if-none-match") == _pending_cache_etag:
+        return Response(status_code=304, headers={"ETag": _pending_cache_etag})
+    return Response(_pending_cache_bytes, media_type="application/json", headers={"ETag": _pending_cache_etag})
+
+
+@app.get("/admin/tokens", response_class=ORJSONResponse, dependencies=[Depends(admin_dep)])
+async def admin_tokens(request: Request):
+    global _tokens_redacted_cache, _tokens_redacted_etag, _tokens_redacted_version
+    #builds a JSON response showing all tokens in memory, but with their sensitive parts (access and refresh tokens) hidden by replacing them with "***".
+    #the serialized bytes are reused until "tokens" changes, so repeated admin polls do not rebuild anything
+    if _tokens_redacted_version != _tokens_version:
+        _tokens_redacted_cache = orjson.dumps({
+            k: {
+                "access_token": "***",
+                "refresh_token": "***",
+                "token_type": v.token_type,
+                "expires_in": v.expires_in,
+                "expires_at": v.expires_at,
+            }
+            for k, v in tokens.items()
+        })
+        _tokens_redacted_etag = _etag(_tokens_redacted_cache)
+        _tokens_redacted_version = _tokens_version
+    #client already has this content → answer with headers only
+    if request.headers.get("if-none-match") == _tokens_redacted_etag:
+        return Response(status_code=304, headers={"ETag": _tokens_redacted_etag})
+    return Response(_tokens_redacted_cache, media_type="application/json", headers={"ETag": _tokens_redacted_etag})